@@ -1,12 +1,14 @@
 import { NextResponse } from "next/server"
 const API_BASE = process.env.NEXT_PUBLIC_API_URL;
-export async function GET() {
+export async function GET(req: Request) {
   try {
     // Try to call the Flask backend with a timeout
     const controller = new AbortController()
     const timeoutId = setTimeout(() => controller.abort(), 10000) // 3 second timeout
-    
-    const response = await fetch(`${API_BASE}/api/health-data`, {
+
+    // Forward filters and pagination (sections, start, end, device, limit, cursor) to the backend
+    const { search } = new URL(req.url)
+    const response = await fetch(`${API_BASE}/api/health-data${search}`, {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
@@ -25,6 +27,11 @@ export async function GET() {
       return NextResponse.json(data)
     }
 
+    // Invalid query parameters are reported as-is rather than masked by mock data
+    if (response && response.status === 400) {
+      return NextResponse.json(await response.json(), { status: 400 })
+    }
+
     // If we reach here, we need to use mock data
     console.log("Using mock data because backend is not accessible")
 
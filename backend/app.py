@@ -6,10 +6,20 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import datetime
+import gzip
 import google.genai as genai
 import logging
 from typing import Optional
 
+from prompt_context import PromptContext, HEALTH_ROW_LEGEND, encode_fall_row, encode_health_row
+from health_query import CsvIndex, SECTION_SOURCES, DERIVED_SECTIONS, encode_cursor, paginate, parse_health_data_query
+
+try:
+    import brotli
+    _HAS_BROTLI = True
+except ImportError:
+    _HAS_BROTLI = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 _HAS_GENAI = True
@@ -74,11 +84,20 @@ class GeminiAI:
 
         logger.info(f"GeminiAI initialized with model: {self.model}")
 
-    def _generate(self, prompt: str, max_output_tokens: Optional[int] = None) -> str:
+    def _generate(self, prompt: str, max_output_tokens: Optional[int] = None,
+                  system_instruction: Optional[str] = None, cached_content: Optional[str] = None) -> str:
         """Internal wrapper around the SDK generate call."""
         try:
             generation_kwargs = {"model": self.model, "contents": prompt}
-            if max_output_tokens:
+            if system_instruction or cached_content:
+                # Shared context goes through the request config instead of the prompt text.
+                config_kwargs = {"max_output_tokens": max_output_tokens} if max_output_tokens else {}
+                if cached_content:
+                    config_kwargs["cached_content"] = cached_content
+                else:
+                    config_kwargs["system_instruction"] = system_instruction
+                generation_kwargs["config"] = genai.types.GenerateContentConfig(**config_kwargs)
+            elif max_output_tokens:
                 try:
                     gen_cfg = genai.types.GenerationConfig(max_output_tokens=max_output_tokens)
                     generation_kwargs["generation_config"] = gen_cfg
@@ -205,22 +224,27 @@ def get_value(row, keys, default="N/A"):
             return row[key].strip()
     return default
 
+# ---------------------------
+# Prompt Context (shared instructions)
+# ---------------------------
+PROMPT_CONTEXT = PromptContext()
+
 # ---------------------------
 # Agent Class (Gemini)
 # ---------------------------
 class Agent:
-    def __init__(self, name, instructions, model="gemini-2.5-flash"):
+    def __init__(self, name, instructions, model="gemini-2.5-flash", legend=None):
         self.name = name
         self.instructions = instructions
         self.model = model
         self.client = GeminiAI(model=model)
+        self.context = PROMPT_CONTEXT.register(name, instructions, self.client, legend=legend)
         print(f"Initialized {name} with Gemini model {model}")
 
-    def generate_response(self, prompt):
+    def generate_response(self, prompt, baseline_prompt=None):
         try:
-            full_prompt = f"{self.instructions}\n\nUser request: {prompt}"
             print(f"{self.name} processing: {prompt[:50]}...")
-            result = self.client._generate(full_prompt)
+            result = PROMPT_CONTEXT.generate(self.name, self.context, self.client, prompt, baseline_prompt)
             print(f"{self.name} response length: {len(result)} characters")
             return result
         except Exception as e:
@@ -259,6 +283,25 @@ def load_csv(file_path):
         reader = csv.DictReader(csvfile)
         return list(reader)
 
+# ---------------------------
+# CSV Index
+# ---------------------------
+_INDEX_CACHE = {}
+
+def load_index(file_path):
+    mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else None
+    cached = _INDEX_CACHE.get(file_path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, CsvIndex(load_csv(file_path)))
+        _INDEX_CACHE[file_path] = cached
+    return cached[1]
+
+DATA_FILES = {
+    "reminders": "backend/data/daily_reminder.csv",
+    "health": "backend/data/health_monitoring.csv",
+    "safety": "backend/data/safety_monitoring.csv",
+}
+
 # ---------------------------
 # Processing Functions
 # ---------------------------
@@ -270,8 +313,8 @@ def process_reminders(reminder_data, agent: Agent):
         sent = row.get('Reminder Sent', 'No')
         acknowledged = row.get('Acknowledged (Yes/No)', 'No')
 
-        prompt = f"Create a friendly reminder for an elderly person about their {reminder_type} scheduled at {scheduled_time}."
-        message = agent.generate_response(prompt)
+        verbose = f"Create a friendly reminder for an elderly person about their {reminder_type} scheduled at {scheduled_time}."
+        message = agent.generate_response(f"{reminder_type} at {scheduled_time}", baseline_prompt=verbose)
 
         if sent == 'Yes' and acknowledged == 'Yes':
             message += " (Acknowledged)"
@@ -298,7 +341,7 @@ def process_health(health_data, agent: Agent):
         oxygen = row.get('Oxygen Saturation', '')
         spo2_threshold = row.get('SpO2 Below Threshold', '')
 
-        prompt = (
+        verbose = (
             f"Analyze these health metrics:\n"
             f"Time: {timestamp}\n"
             f"Heart Rate: {heart_rate} bpm (Abnormal: {hr_threshold})\n"
@@ -306,7 +349,7 @@ def process_health(health_data, agent: Agent):
             f"Glucose: {glucose} mg/dL (Abnormal: {glucose_threshold})\n"
             f"Oxygen Saturation: {oxygen}% (Below threshold: {spo2_threshold})"
         )
-        message = agent.generate_response(prompt)
+        message = agent.generate_response(encode_health_row(row), baseline_prompt=verbose)
 
         alert_conditions = []
         if hr_threshold == 'Yes':
@@ -344,14 +387,14 @@ def process_safety(safety_data, agent: Agent):
         location = row.get('Location', '')
 
         if fall_detected == 'Yes':
-            prompt = (
+            verbose = (
                 f"A fall was detected:\n"
                 f"Time: {timestamp}\n"
                 f"Location: {location}\n"
                 f"Impact Level: {impact_level}\n"
                 f"Inactivity Duration: {inactivity} seconds"
             )
-            message = agent.generate_response(prompt)
+            message = agent.generate_response(encode_fall_row(row), baseline_prompt=verbose)
             fall_alerts.append({
                 "subject": "URGENT: Fall Detected",
                 "message": (
@@ -401,37 +444,74 @@ def get_caregiver_notification(safety_data, health_data, agent: Agent):
 # ---------------------------
 # Run Agents
 # ---------------------------
-def run_agents():
-    reminder_agent = Agent("Reminder Agent", reminder_instructions)
-    health_agent = Agent("Health Agent", health_instructions)
-    safety_agent = Agent("Safety Agent", safety_instructions)
-    caregiver_agent = Agent("Caregiver Agent", caregiver_instructions)
-
-    reminder_data = load_csv("backend/data/daily_reminder.csv")
-    health_data = load_csv("backend/data/health_monitoring.csv")
-    safety_data = load_csv("backend/data/safety_monitoring.csv")
+def run_agents(query=None):
+    query = query or parse_health_data_query({})
+    # Derived sections cover the whole filtered range, so they are only computed on the first page.
+    sections = [s for s in query["sections"] if not (query["cursor"] and s in DERIVED_SECTIONS)]
+    sources = set().union(*(SECTION_SOURCES[s] for s in sections))
+    # Only derived sections read the whole filtered range; row sections touch just their page.
+    derived_sources = set().union(*(SECTION_SOURCES[s] for s in sections if s in DERIVED_SECTIONS))
+
+    # Agents are only created for sections that were requested.
+    agent_specs = {
+        "reminders": ("Reminder Agent", reminder_instructions, None),
+        "health": ("Health Agent", health_instructions, HEALTH_ROW_LEGEND),
+        "safety": ("Safety Agent", safety_instructions, None),
+        "caregiver": ("Caregiver Agent", caregiver_instructions, None),
+    }
+    agents = {}
+    def get_agent(key):
+        if key not in agents:
+            name, instructions, legend = agent_specs[key]
+            agents[key] = Agent(name, instructions, legend=legend)
+        return agents[key]
+
+    filtered, pages, next_cursor = {}, {}, {}
+    has_more = False
+    for source in sources:
+        index = load_index(DATA_FILES[source])
+        positions = index.select(query["devices"], query["start"], query["end"])
+        if source in derived_sources:
+            filtered[source] = [index.rows[pos] for pos in positions]
+        if source in sections:
+            page, next_cursor[source], more = paginate(positions, query["cursor"].get(source, -1), query["limit"])
+            has_more = has_more or more
+            pages[source] = [index.rows[pos] for pos in page]
 
     results = {}
-    results['reminders'] = process_reminders(reminder_data, reminder_agent)
-    results['health'] = process_health(health_data, health_agent)
-    results['safety'] = process_safety(safety_data, safety_agent)
-    results['caregiver'] = get_caregiver_notification(safety_data, health_data, caregiver_agent)
-
-    if results['health']:
-        latest_health_data = results['health'][-1]
-        prompt = f"Based on this health data: {latest_health_data}\n\nProvide 3 personalized health insights."
-        results['health_insights'] = [health_agent.generate_response(prompt)]
-    else:
-        results['health_insights'] = []
-
-    fall_incidents = [alert for alert in results['safety'] if "fall was detected" in alert.lower()]
-    if fall_incidents:
-        latest_fall = fall_incidents[-1]
-        prompt = f"Based on this fall incident: {latest_fall}\n\nProvide safety recommendations."
-        results['safety_analysis'] = [safety_agent.generate_response(prompt)]
-    else:
-        results['safety_analysis'] = []
+    if "reminders" in sections:
+        results['reminders'] = process_reminders(pages["reminders"], get_agent("reminders"))
+    if "health" in sections:
+        results['health'] = process_health(pages["health"], get_agent("health"))
+    if "safety" in sections:
+        results['safety'] = process_safety(pages["safety"], get_agent("safety"))
+    if "caregiver" in sections:
+        results['caregiver'] = get_caregiver_notification(filtered["safety"], filtered["health"], get_agent("caregiver"))
+
+    # Insights and analysis are built from the filtered rows, independent of the page contents.
+    if "health_insights" in sections:
+        readings = [row for row in filtered["health"] if '####' not in row.get('Timestamp', '')]
+        if readings:
+            prompt = f"Based on this health data: {encode_health_row(readings[-1])}\n\nProvide 3 personalized health insights."
+            results['health_insights'] = [get_agent("health").generate_response(prompt)]
+        else:
+            results['health_insights'] = []
+
+    if "safety_analysis" in sections:
+        falls = [row for row in filtered["safety"] if row.get('Fall Detected', 'No') == 'Yes']
+        if falls:
+            prompt = f"Based on this fall incident: {encode_fall_row(falls[-1])}\n\nProvide safety recommendations."
+            results['safety_analysis'] = [get_agent("safety").generate_response(prompt)]
+        else:
+            results['safety_analysis'] = []
 
+    if query["limit"] is not None or query["cursor"]:
+        results['next_cursor'] = encode_cursor(query["filters_key"], next_cursor) if has_more else None
+
+    for name, stats in PROMPT_CONTEXT.report().items():
+        logger.info("%s input tokens: %d (baseline %d, compaction saved %d, cache saved %d, %.1f%%)", name,
+                    stats["input_tokens"], stats["baseline_tokens"], stats["compaction_saved_tokens"],
+                    stats["cache_saved_tokens"], stats["saved_percent"])
     return results
 
 # ---------------------------
@@ -444,10 +524,34 @@ CORS(app)
 def index():
     return jsonify({"message": "Healthcare API is running"})
 
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def compress_response(response):
+    # brotli is optional (pip install brotli); gzip is always available.
+    if (response.is_streamed or response.direct_passthrough or not 200 <= response.status_code < 300
+            or "Content-Encoding" in response.headers or not request.accept_encodings):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if _HAS_BROTLI else ["gzip"])
+    if encoding is None:
+        return response
+    response.set_data(brotli.compress(data, quality=BROTLI_QUALITY) if encoding == "br" else gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
 @app.route('/api/health-data', methods=['GET'])
 def health_data():
     try:
-        return jsonify(run_agents())
+        query = parse_health_data_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return compress_response(jsonify(run_agents(query)))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -468,6 +572,10 @@ def ai_health_question():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/prompt-stats', methods=['GET'])
+def prompt_stats():
+    return jsonify(PROMPT_CONTEXT.report())
+
 @app.route('/api/test-email', methods=['GET'])
 def test_email():
     try:
@@ -0,0 +1,186 @@
+"""
+health_query.py
+Query parsing, CSV indexing and cursor pagination for /api/health-data.
+
+Kept free of Flask and Gemini imports so it can be tested on its own.
+
+Query parameters:
+    sections=health,safety     subset of SECTIONS (default: all)
+    start=, end=               naive ISO timestamps, inclusive
+    device=D1000,D1001         repeatable and/or comma-separated
+    limit=N                    rows per row-level section
+    cursor=...                 next_cursor from the previous page
+
+Pagination only applies to the row-level sections (reminders, health, safety).
+The derived sections (caregiver, health_insights, safety_analysis) summarise the
+whole filtered range, so they are returned on the first page only and left out
+of responses to a cursor request.
+"""
+
+import base64
+import bisect
+import datetime
+import hashlib
+import json
+
+DEVICE_COLUMN = 'Device-ID/User-ID'
+TIMESTAMP_FORMATS = ("%m/%d/%Y %H:%M", "%m-%d-%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%m-%d-%Y %H:%M:%S")
+
+ROW_SECTIONS = ("reminders", "health", "safety")
+DERIVED_SECTIONS = ("caregiver", "health_insights", "safety_analysis")
+SECTIONS = ROW_SECTIONS + DERIVED_SECTIONS
+# Row-level sections each section reads from.
+SECTION_SOURCES = {
+    "reminders": {"reminders"},
+    "health": {"health"},
+    "safety": {"safety"},
+    "caregiver": {"health", "safety"},
+    "health_insights": {"health"},
+    "safety_analysis": {"safety"},
+}
+MAX_PAGE_SIZE = 100
+
+
+def parse_timestamp(value):
+    value = (value or "").strip()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class CsvIndex:
+    """
+    Rows of one CSV file with lookups by device and by timestamp.
+
+    Rows are addressed by their position in the file; select() returns positions in file
+    order so callers only touch the rows they actually need.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_device = {}
+        self.by_time = []
+        for pos, row in enumerate(rows):
+            self.by_device.setdefault(row.get(DEVICE_COLUMN, '').strip(), []).append(pos)
+            ts = parse_timestamp(row.get('Timestamp', ''))
+            if ts is not None:
+                self.by_time.append((ts, pos))
+        self.by_time.sort()
+
+    def select(self, devices=None, start=None, end=None):
+        if start is None and end is None:
+            positions = None
+        else:
+            # Rows with unparseable timestamps never match an explicit time range.
+            lo = bisect.bisect_left(self.by_time, (start,)) if start else 0
+            hi = bisect.bisect_right(self.by_time, (end, len(self.rows))) if end else len(self.by_time)
+            positions = {pos for _, pos in self.by_time[lo:hi]}
+        if devices:
+            matched = {pos for device in devices for pos in self.by_device.get(device, [])}
+            positions = matched if positions is None else positions & matched
+        if positions is None:
+            return list(range(len(self.rows)))
+        return sorted(positions)
+
+
+def filters_key(sections, devices, start, end):
+    """Short hash of the filters a cursor was issued for."""
+    filters = [
+        sorted(sections),
+        sorted(devices or []),
+        start.isoformat() if start else None,
+        end.isoformat() if end else None,
+    ]
+    return hashlib.sha1(json.dumps(filters).encode()).hexdigest()[:12]
+
+
+def encode_cursor(key, positions):
+    payload = json.dumps({"f": key, "p": positions}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (filters_key, {section: last position}) or raise ValueError."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or not isinstance(payload.get("f"), str):
+        raise ValueError("Invalid cursor")
+    positions = payload.get("p")
+    # type() rather than isinstance(): bool is a subclass of int.
+    if not isinstance(positions, dict) or not all(
+        section in ROW_SECTIONS and type(pos) is int for section, pos in positions.items()
+    ):
+        raise ValueError("Invalid cursor")
+    return payload["f"], positions
+
+
+def _getlist(args, key):
+    # Flask's request.args is a MultiDict, so repeated keys are all kept; plain dicts also work.
+    if hasattr(args, "getlist"):
+        return args.getlist(key)
+    value = args.get(key)
+    return [value] if value else []
+
+
+def parse_health_data_query(args):
+    """Parse /api/health-data query parameters into a query dict; raises ValueError on bad input."""
+    sections = [s.strip() for s in args.get("sections", "").split(",") if s.strip()] or list(SECTIONS)
+    unknown = [s for s in sections if s not in SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown section(s): {', '.join(unknown)}")
+
+    bounds = {}
+    for key in ("start", "end"):
+        value = args.get(key)
+        try:
+            bounds[key] = datetime.datetime.fromisoformat(value) if value else None
+        except ValueError:
+            raise ValueError(f"Invalid {key} timestamp: {value}")
+        if bounds[key] is not None and bounds[key].tzinfo is not None:
+            raise ValueError(f"{key} must not include a timezone offset; data timestamps are local times")
+
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f"Invalid limit: {limit}")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    devices = {d.strip() for value in _getlist(args, "device") for d in value.split(",") if d.strip()}
+    key = filters_key(sections, devices, bounds["start"], bounds["end"])
+
+    cursor = args.get("cursor")
+    positions = {}
+    if cursor:
+        cursor_key, positions = decode_cursor(cursor)
+        if cursor_key != key:
+            raise ValueError("cursor was issued for different filters; resend the original query parameters")
+
+    return {
+        "sections": sections,
+        "devices": devices or None,
+        "start": bounds["start"],
+        "end": bounds["end"],
+        "limit": limit,
+        "cursor": positions,
+        "filters_key": key,
+    }
+
+
+def paginate(positions, after, limit):
+    """
+    Split sorted row positions into the page after `after` (a previous cursor position).
+
+    Returns (page, next position, has_more). An exhausted section keeps its position so
+    later pages return nothing for it.
+    """
+    remaining = positions[bisect.bisect_right(positions, after):]
+    page = remaining[:limit] if limit else remaining
+    return page, (page[-1] if page else after), len(page) < len(remaining)
@@ -0,0 +1,171 @@
+"""
+prompt_context.py
+Shared agent instructions and compact row encodings for the Gemini agents.
+
+Each agent's instructions are registered once per process. The savings report compares
+what is sent now against the old path, which re-sent the original instructions and a
+verbose prompt on every call.
+
+Kept free of Flask imports so it can be tested with a stub client.
+"""
+
+import logging
+
+try:
+    from google import genai
+except Exception:
+    genai = None
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_MIN_TOKENS = 1024  # Gemini rejects cached contents smaller than this
+CONTEXT_CACHE_TTL = "3600s"
+
+
+def estimate_tokens(text):
+    # Rough ~4 characters per token. Used for both sides of the savings report so they compare.
+    return (len(text) + 3) // 4 if text else 0
+
+
+def _is_cache_miss(error):
+    # Expired or deleted cached content comes back as an API error naming the cache.
+    message = str(error).lower()
+    return "cache" in message and (
+        getattr(error, "code", None) == 404
+        or any(word in message for word in ("expired", "not found", "does not exist"))
+    )
+
+
+class PromptContext:
+    """
+    Registers each agent's instructions once per process and reuses them on every call.
+
+    Instructions are delivered in one of three modes, best first:
+      - "cache":  stored as SDK cached content and referenced by name.
+      - "system": sent as the request's system_instruction (still billed on every call).
+      - "inline": local fallback, prefixed onto the prompt text as before.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._stats = {}
+
+    def register(self, name, instructions, client, legend=None):
+        """`legend` explains a compact prompt encoding; it is sent but not part of the baseline."""
+        key = (client.model, instructions, legend)
+        entry = self._entries.get(key)
+        if entry is None:
+            full = f"{instructions} {legend}" if legend else instructions
+            entry = {"instructions": full, "baseline_instructions": instructions,
+                     "mode": "inline", "cache_name": None, "tokens": estimate_tokens(full)}
+            if hasattr(getattr(genai, "types", None), "GenerateContentConfig"):
+                entry["mode"] = "system"
+                if entry["tokens"] >= CONTEXT_CACHE_MIN_TOKENS and self._create_cache(name, entry, client):
+                    entry["mode"] = "cache"
+            self._entries[key] = entry
+            logger.info("Registered instructions for %s (mode=%s)", name, entry["mode"])
+        self._stats.setdefault(name, {"calls": 0, "input_tokens": 0, "baseline_tokens": 0,
+                                      "compaction_saved_tokens": 0, "cache_saved_tokens": 0})
+        return entry
+
+    def _create_cache(self, name, entry, client):
+        try:
+            cache = client.client.caches.create(
+                model=client.model,
+                config=genai.types.CreateCachedContentConfig(
+                    system_instruction=entry["instructions"], ttl=CONTEXT_CACHE_TTL
+                ),
+            )
+        except Exception as e:
+            logger.info("Context caching unavailable for %s, using system instruction: %s", name, e)
+            return False
+        entry["cache_name"] = cache.name
+        return True
+
+    def _replace_cache(self, name, entry, client):
+        old_name, entry["cache_name"] = entry["cache_name"], None
+        try:
+            client.client.caches.delete(name=old_name)
+        except Exception:
+            # Already gone server-side, which is the usual reason we got here.
+            pass
+        return self._create_cache(name, entry, client)
+
+    def generate(self, name, entry, client, prompt, baseline_prompt=None):
+        mode = entry["mode"]
+        if mode == "cache":
+            try:
+                result = client._generate(prompt, cached_content=entry["cache_name"])
+            except Exception as e:
+                if not _is_cache_miss(e):
+                    raise
+                logger.info("Cached context for %s expired, recreating it.", name)
+                if self._replace_cache(name, entry, client):
+                    result = client._generate(prompt, cached_content=entry["cache_name"])
+                else:
+                    entry["mode"] = mode = "system"
+                    result = client._generate(prompt, system_instruction=entry["instructions"])
+        elif mode == "system":
+            result = client._generate(prompt, system_instruction=entry["instructions"])
+        else:
+            result = client._generate(f"{entry['instructions']}\n\nUser request: {prompt}")
+        self._record(name, entry, mode, prompt, baseline_prompt)
+        return result
+
+    def _record(self, name, entry, mode, prompt, baseline_prompt):
+        # Baseline is the old path: original instructions, the "User request:" wrapper and the
+        # verbose prompt, all re-sent on every call.
+        baseline = estimate_tokens(f"{entry['baseline_instructions']}\n\nUser request: {baseline_prompt or prompt}")
+        if mode == "cache":
+            sent = estimate_tokens(prompt)
+        else:
+            # A system instruction carries its own role framing, so count it like the inline wrapper
+            # rather than crediting the dropped "User request:" text as a saving.
+            sent = estimate_tokens(f"{entry['instructions']}\n\nUser request: {prompt}")
+        cache_saved = entry["tokens"] if mode == "cache" else 0
+        stats = self._stats[name]
+        stats["calls"] += 1
+        stats["input_tokens"] += sent
+        stats["baseline_tokens"] += baseline
+        stats["cache_saved_tokens"] += cache_saved
+        # Negative if a legend costs more than the compact encoding saves.
+        stats["compaction_saved_tokens"] += baseline - sent - cache_saved
+        stats["mode"] = mode
+
+    def report(self):
+        report = {}
+        for name, stats in self._stats.items():
+            saved = stats["baseline_tokens"] - stats["input_tokens"]
+            report[name] = dict(stats, saved_tokens=saved, saved_percent=(
+                round(100.0 * saved / stats["baseline_tokens"], 1) if stats["baseline_tokens"] else 0.0
+            ))
+        return report
+
+
+# ---------------------------
+# Compact Row Encoding
+# ---------------------------
+HEALTH_ROW_LEGEND = "Vitals: HR bpm, BP, glucose mg/dL, SpO2 %; '!' = abnormal."
+HEALTH_ROW_FIELDS = [
+    ("HR", 'Heart Rate', 'Heart Rate Below/Above Threshold'),
+    ("BP", 'Blood Pressure', 'Blood Pressure Below/Above Threshold'),
+    ("glucose", 'Glucose Levels', 'Glucose Levels Below/Above Threshold'),
+    ("SpO2", 'Oxygen Saturation', 'SpO2 Below Threshold'),
+]
+
+
+def encode_health_row(row):
+    parts = [row.get('Timestamp', '')]
+    for label, value_col, flag_col in HEALTH_ROW_FIELDS:
+        flag = "!" if row.get(flag_col, '') == 'Yes' else ""
+        parts.append(f"{label} {row.get(value_col, '')}{flag}")
+    return " ".join(parts)
+
+
+def encode_fall_row(row):
+    # Plain wording needs no legend, which keeps it cheaper than key=value plus an explanation.
+    return (
+        f"Fall at {row.get('Timestamp', '')} in {row.get('Location', '')}, "
+        f"{row.get('Impact Force Level', '-')} impact, "
+        f"inactive {row.get('Post-Fall Inactivity Duration (Seconds)', '0')}s"
+    )
@@ -0,0 +1,118 @@
+import datetime
+
+import pytest
+
+from health_query import (
+    CsvIndex,
+    SECTIONS,
+    decode_cursor,
+    encode_cursor,
+    paginate,
+    parse_health_data_query,
+)
+
+ROWS = [
+    {"Device-ID/User-ID": "D1000", "Timestamp": "1/22/2025 20:4"},
+    {"Device-ID/User-ID": "D1001", "Timestamp": "01-07-2025 16:04"},
+    {"Device-ID/User-ID": "D1000", "Timestamp": "####"},
+    {"Device-ID/User-ID": "D1002", "Timestamp": "1/30/2025 3:01"},
+    {"Device-ID/User-ID": "D1001", "Timestamp": "1/16/2025 12:2"},
+]
+
+
+class Args(dict):
+    """Stand-in for Flask's MultiDict: values are lists, get() returns the first one."""
+
+    def get(self, key, default=None):
+        values = super().get(key)
+        return values[0] if values else default
+
+    def getlist(self, key):
+        return super().get(key, [])
+
+
+def test_select_without_filters_returns_every_row_in_file_order():
+    assert CsvIndex(ROWS).select() == [0, 1, 2, 3, 4]
+
+
+def test_select_by_time_range_is_inclusive_and_skips_unparseable_timestamps():
+    index = CsvIndex(ROWS)
+    start = datetime.datetime(2025, 1, 16, 12, 2)
+    end = datetime.datetime(2025, 1, 22, 20, 4)
+    assert index.select(start=start, end=end) == [0, 4]
+    assert index.select(start=start) == [0, 3, 4]
+    assert index.select(end=datetime.datetime(2025, 1, 10)) == [1]
+
+
+def test_select_by_device_combines_with_time_range():
+    index = CsvIndex(ROWS)
+    assert index.select(devices={"D1000"}) == [0, 2]
+    assert index.select(devices={"D1000", "D1002"}) == [0, 2, 3]
+    assert index.select(devices={"D1000"}, start=datetime.datetime(2025, 1, 1)) == [0]
+    assert index.select(devices={"D9999"}) == []
+
+
+def test_parse_defaults_to_all_sections_without_paging():
+    query = parse_health_data_query({})
+    assert query["sections"] == list(SECTIONS)
+    assert query["devices"] is None
+    assert query["limit"] is None
+    assert query["cursor"] == {}
+
+
+def test_parse_collects_repeated_and_comma_separated_devices():
+    query = parse_health_data_query(Args(device=["D1000", "D1001,D1002"]))
+    assert query["devices"] == {"D1000", "D1001", "D1002"}
+
+
+@pytest.mark.parametrize("args", [
+    {"sections": "health,bogus"},
+    {"start": "yesterday"},
+    {"start": "2025-01-10T00:00:00+00:00"},
+    {"end": "2025-01-10T00:00:00Z"},
+    {"limit": "abc"},
+    {"limit": "0"},
+    {"limit": "101"},
+    {"cursor": "not-a-cursor"},
+])
+def test_parse_rejects_invalid_parameters(args):
+    with pytest.raises(ValueError):
+        parse_health_data_query(args)
+
+
+@pytest.mark.parametrize("positions", [
+    {"health": True},
+    {"health": "3"},
+    {"caregiver": 3},
+])
+def test_decode_cursor_rejects_bad_positions(positions):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor("abc", positions))
+
+
+def test_cursor_round_trip_and_filter_mismatch():
+    first = parse_health_data_query({"sections": "health", "limit": "2"})
+    cursor = encode_cursor(first["filters_key"], {"health": 4})
+    assert decode_cursor(cursor) == (first["filters_key"], {"health": 4})
+
+    # limit may change between pages; the filters may not.
+    second = parse_health_data_query({"sections": "health", "limit": "5", "cursor": cursor})
+    assert second["cursor"] == {"health": 4}
+    with pytest.raises(ValueError):
+        parse_health_data_query({"sections": "health", "device": "D1000", "cursor": cursor})
+
+
+def test_paginate_walks_pages_until_exhausted():
+    positions = [0, 2, 3, 5, 7]
+    page, after, more = paginate(positions, -1, 2)
+    assert (page, after, more) == ([0, 2], 2, True)
+    page, after, more = paginate(positions, after, 2)
+    assert (page, after, more) == ([3, 5], 5, True)
+    page, after, more = paginate(positions, after, 2)
+    assert (page, after, more) == ([7], 7, False)
+    # An exhausted section keeps its position and yields nothing.
+    assert paginate(positions, after, 2) == ([], 7, False)
+
+
+def test_paginate_without_limit_returns_everything_after_cursor():
+    assert paginate([1, 4, 6], 1, None) == ([4, 6], 6, False)
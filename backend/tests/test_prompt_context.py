@@ -0,0 +1,185 @@
+from types import SimpleNamespace
+
+import pytest
+
+import prompt_context
+from prompt_context import (
+    CONTEXT_CACHE_MIN_TOKENS,
+    PromptContext,
+    encode_fall_row,
+    encode_health_row,
+    estimate_tokens,
+)
+
+LONG_INSTRUCTIONS = "x" * (CONTEXT_CACHE_MIN_TOKENS * 4)
+
+
+class ApiError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class StubCaches:
+    def __init__(self, fail_create=False):
+        self.fail_create = fail_create
+        self.created = []
+        self.deleted = []
+
+    def create(self, model, config):
+        if self.fail_create:
+            raise ApiError(400, "caching not supported")
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append(name)
+        return SimpleNamespace(name=name)
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class StubClient:
+    """Mimics GeminiAI: .model, .client.caches and _generate(), with scripted failures."""
+
+    def __init__(self, errors=(), fail_create=False):
+        self.model = "stub-model"
+        self.client = SimpleNamespace(caches=StubCaches(fail_create))
+        self.errors = list(errors)
+        self.calls = []
+
+    def _generate(self, prompt, **kwargs):
+        self.calls.append((prompt, kwargs))
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def sdk(monkeypatch):
+    types = SimpleNamespace(GenerateContentConfig=dict, CreateCachedContentConfig=dict)
+    monkeypatch.setattr(prompt_context, "genai", SimpleNamespace(types=types))
+
+
+def test_register_falls_back_to_inline_without_sdk(monkeypatch):
+    monkeypatch.setattr(prompt_context, "genai", None)
+    client = StubClient()
+    context = PromptContext()
+    entry = context.register("Agent", "Be kind.", client)
+    assert entry["mode"] == "inline"
+    context.generate("Agent", entry, client, "hello")
+    assert client.calls == [("Be kind.\n\nUser request: hello", {})]
+
+
+def test_register_uses_system_mode_below_cache_minimum(sdk):
+    client = StubClient()
+    context = PromptContext()
+    entry = context.register("Agent", "Be kind.", client, legend="Legend.")
+    assert entry["mode"] == "system"
+    assert client.client.caches.created == []
+    context.generate("Agent", entry, client, "hello")
+    assert client.calls == [("hello", {"system_instruction": "Be kind. Legend."})]
+
+
+def test_register_caches_long_instructions_once(sdk):
+    client = StubClient()
+    context = PromptContext()
+    entry = context.register("Agent", LONG_INSTRUCTIONS, client)
+    assert entry is context.register("Agent", LONG_INSTRUCTIONS, client)
+    assert entry["mode"] == "cache"
+    assert client.client.caches.created == ["cachedContents/1"]
+
+
+def test_register_uses_system_mode_when_cache_creation_fails(sdk):
+    entry = PromptContext().register("Agent", LONG_INSTRUCTIONS, StubClient(fail_create=True))
+    assert entry["mode"] == "system"
+
+
+def test_expired_cache_is_replaced_and_retried(sdk):
+    client = StubClient(errors=[ApiError(404, "CachedContent not found")])
+    context = PromptContext()
+    entry = context.register("Agent", LONG_INSTRUCTIONS, client)
+    assert context.generate("Agent", entry, client, "hello") == "ok"
+    assert client.client.caches.deleted == ["cachedContents/1"]
+    assert entry["cache_name"] == "cachedContents/2"
+    assert entry["mode"] == "cache"
+    assert client.calls[-1] == ("hello", {"cached_content": "cachedContents/2"})
+
+
+def test_expired_cache_falls_back_to_system_when_recreate_fails(sdk):
+    client = StubClient(errors=[ApiError(400, "Cache content is expired")])
+    context = PromptContext()
+    entry = context.register("Agent", LONG_INSTRUCTIONS, client)
+    client.client.caches.fail_create = True
+    assert context.generate("Agent", entry, client, "hello") == "ok"
+    assert entry["mode"] == "system"
+    assert client.calls[-1] == ("hello", {"system_instruction": LONG_INSTRUCTIONS})
+
+
+def test_other_errors_in_cache_mode_are_raised_without_touching_the_cache(sdk):
+    client = StubClient(errors=[ApiError(429, "Resource exhausted")])
+    context = PromptContext()
+    entry = context.register("Agent", LONG_INSTRUCTIONS, client)
+    with pytest.raises(ApiError):
+        context.generate("Agent", entry, client, "hello")
+    assert client.client.caches.created == ["cachedContents/1"]
+    assert client.client.caches.deleted == []
+    assert entry["mode"] == "cache"
+
+
+def test_record_without_compaction_reports_no_savings(sdk):
+    client = StubClient()
+    context = PromptContext()
+    entry = context.register("Agent", "Be kind.", client)
+    context.generate("Agent", entry, client, "same prompt")
+    stats = context.report()["Agent"]
+    assert stats["input_tokens"] == stats["baseline_tokens"]
+    assert stats["saved_tokens"] == stats["compaction_saved_tokens"] == stats["cache_saved_tokens"] == 0
+    assert stats["saved_percent"] == 0.0
+
+
+def test_record_measures_baseline_against_original_instructions(sdk):
+    client = StubClient()
+    context = PromptContext()
+    entry = context.register("Agent", "Be kind.", client, legend="Legend text.")
+    verbose = "a much longer verbose prompt " * 4
+    context.generate("Agent", entry, client, "short", baseline_prompt=verbose)
+    context.generate("Agent", entry, client, "short", baseline_prompt=verbose)
+
+    baseline = estimate_tokens(f"Be kind.\n\nUser request: {verbose}")
+    sent = estimate_tokens("Be kind. Legend text.\n\nUser request: short")
+    stats = context.report()["Agent"]
+    assert stats["calls"] == 2
+    assert stats["baseline_tokens"] == 2 * baseline
+    assert stats["input_tokens"] == 2 * sent
+    assert stats["compaction_saved_tokens"] == stats["saved_tokens"] == 2 * (baseline - sent)
+    assert stats["cache_saved_tokens"] == 0
+    assert stats["saved_percent"] == round(100.0 * (baseline - sent) / baseline, 1)
+
+
+def test_record_counts_cached_instructions_as_saved(sdk):
+    client = StubClient()
+    context = PromptContext()
+    entry = context.register("Agent", LONG_INSTRUCTIONS, client)
+    context.generate("Agent", entry, client, "hello")
+    stats = context.report()["Agent"]
+    assert stats["input_tokens"] == estimate_tokens("hello")
+    assert stats["cache_saved_tokens"] == estimate_tokens(LONG_INSTRUCTIONS)
+    assert stats["saved_tokens"] == stats["baseline_tokens"] - stats["input_tokens"]
+
+
+def test_encode_health_row_flags_abnormal_values():
+    row = {
+        "Timestamp": "1/22/2025 20:4",
+        "Heart Rate": "116", "Heart Rate Below/Above Threshold": "Yes",
+        "Blood Pressure": "118/79 mmHg", "Blood Pressure Below/Above Threshold": "No",
+        "Glucose Levels": "141", "Glucose Levels Below/Above Threshold": "Yes",
+        "Oxygen Saturation": "98", "SpO2 Below Threshold": "No",
+    }
+    assert encode_health_row(row) == "1/22/2025 20:4 HR 116! BP 118/79 mmHg glucose 141! SpO2 98"
+
+
+def test_encode_fall_row():
+    row = {
+        "Timestamp": "1/19/2025 19:46", "Location": "Bathroom",
+        "Impact Force Level": "Medium", "Post-Fall Inactivity Duration (Seconds)": "463",
+    }
+    assert encode_fall_row(row) == "Fall at 1/19/2025 19:46 in Bathroom, Medium impact, inactive 463s"